@@ -15,43 +15,86 @@
 
 import argparse
 import csv
+import hashlib
+import io
 import json
+import mmap
 import os
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from itertools import zip_longest
 from pathlib import Path
 from typing import Dict, Any, Optional, List
+from urllib.parse import quote
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from google.auth.transport.requests import Request as GoogleAuthRequest
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
+
+try:
+    import orjson  # optional C-accelerated JSON
+except ImportError:
+    orjson = None
 
 SCOPES = [
     "https://www.googleapis.com/auth/spreadsheets.readonly",
     "https://www.googleapis.com/auth/drive.readonly",
 ]
 
+# Normalized header names identifying the submitter column, in lookup priority
+_NAME_KEYS = ("name",)
+_SUBMITTER_KEYS = ("name", "submitted by")
+
 # ---------------- Column mapping ----------------
+_COL_MAP = {
+    "What do you do?": "Role",
+    "What knowledge would you like to share?": "Expertise",
+    "What would you like to learn?": "Interest",
+    "What additional would you like to share?": "Note",
+    "Submitted By": "Name",
+    "Timestamp": "Time",
+}
+
 def map_columns_to_labels(columns):
-    mapping = {
-        "What do you do?": "Role",
-        "What knowledge would you like to share?": "Expertise",
-        "What would you like to learn?": "Interest",
-        "What additional would you like to share?": "Note",
-        "Submitted By": "Name",
-        "Timestamp": "Time",
-    }
-    return [mapping.get(col, col) for col in columns]
+    return [_COL_MAP.get(col, col) for col in columns]
+
+def resolve_headers(raw_headers) -> List[str]:
+    """Normalized, mapped labels of a sheet's header row (blank headers become col_<n>)."""
+    return [
+        label or f"col_{i + 1}"
+        for i, label in enumerate(map_columns_to_labels([_norm(h) for h in raw_headers]))
+    ]
 
 def parse_args():
     ap = argparse.ArgumentParser(
         description="Fetch a Google Sheet and append CSV; write pretty JSON and maintain a shared ontology-mapping cache."
     )
     ap.add_argument("--spreadsheet-id", required=True)
-    ap.add_argument("--sheet-name", required=True)
-    ap.add_argument("--csv-out", required=True, help="Path for CSV (mapped headers, append)")
-    ap.add_argument("--json-out", required=True, help="Path for pretty JSON array (user entries)")
+    ap.add_argument("--sheet-name", required=True, action="append",
+                    help="Tab to process; repeat for several tabs (fetched in one batchGet request)")
+    ap.add_argument("--csv-out", required=True,
+                    help="Path for CSV (mapped headers, append); '{sheet}' is replaced by the tab name")
+    ap.add_argument("--json-out", required=True,
+                    help="Path for the JSON user entries; '{sheet}' is replaced by the tab name")
+    ap.add_argument("--json-format", choices=("pretty", "jsonl"), default="pretty",
+                    help="JSON output layout: indented array (default) or one compact entry per line")
     ap.add_argument("--mappings-store", default=None,
                     help="Path for the shared mappings cache JSON (default: next to json-out as mappings_store.json)")
+    ap.add_argument("--llm-cache", default=None,
+                    help="Path for the LLM response cache JSONL (default: next to json-out as llm_cache.jsonl)")
+    ap.add_argument("--state-file", default=None,
+                    help="Path for the per-spreadsheet/tab sync state JSON (default: next to json-out as sheet_state.json)")
+    ap.add_argument("--full-refresh", action="store_true",
+                    help="Fetch the whole tab even if a previous run recorded its last row "
+                         "(use after rows were edited or deleted in the sheet)")
+    ap.add_argument("--page-rows", type=int, default=0,
+                    help="Fetch each tab in windows of this many rows, up to its grid row count "
+                         "(0: one request for all rows); bounds the size of each Sheets response")
     ap.add_argument("--sa-key-file", required=True)
 
     # LLM mapping toggle: default True, but allow --no-llm-mapping to disable
@@ -67,52 +110,499 @@ def parse_args():
     ap.add_argument("--openrouter-base-url", default="https://openrouter.ai/api/v1/chat/completions")
     ap.add_argument("--openrouter-timeout", type=int, default=60)
     ap.add_argument("--openrouter-sleep", type=float, default=0.0,
-                    help="Sleep seconds between LLM calls (rate limiting)")
-    return ap.parse_args()
+                    help="Minimum seconds between LLM call starts, shared by all workers (rate limiting)")
+    ap.add_argument("--openrouter-batch-size", type=int, default=20,
+                    help="Number of users mapped per OpenRouter request (0: all pending users in one request)")
+    ap.add_argument("--openrouter-concurrency", type=int, default=4,
+                    help="Maximum number of OpenRouter requests in flight")
+    ap.add_argument("--openrouter-tpm", type=int, default=0,
+                    help="Estimated tokens allowed per minute across all workers (0: unlimited)")
+    ap.add_argument("--openrouter-rpm", type=int, default=0,
+                    help="Requests allowed per minute across all workers (0: unlimited)")
+    args = ap.parse_args()
+    args.sheet_name = list(dict.fromkeys(args.sheet_name))
+    if len(args.sheet_name) > 1 and not all("{sheet}" in p for p in (args.csv_out, args.json_out)):
+        ap.error("--csv-out and --json-out must contain '{sheet}' when several --sheet-name are given")
+    return args
+
+# ---------------- HTTP ----------------
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class _RateLimitRetry(Retry):
+    """
+    urllib3 Retry that also honors OpenRouter's X-RateLimit-Reset (epoch ms) when
+    Retry-After is absent, and logs every retry.
+    """
+
+    MAX_RESET_WAIT = 60.0
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            reset = response.headers.get("X-RateLimit-Reset")
+            try:
+                retry_after = min(self.MAX_RESET_WAIT, max(0.0, float(reset) / 1000.0 - time.time()))
+            except (TypeError, ValueError):
+                pass
+        return retry_after
+
+    def increment(self, method=None, url=None, response=None, error=None, *args, **kwargs):
+        new = super().increment(method, url, response, error, *args, **kwargs)
+        reason = f"HTTP {response.status}" if response is not None and response.status else type(error).__name__
+        print(f"↻ {method} {url}: {reason}; {new.total} retries left")
+        return new
+
+def _make_session() -> requests.Session:
+    """Shared keep-alive session; transient failures (incl. 429, honoring rate-limit headers) are retried with backoff."""
+    retry = _RateLimitRetry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=_RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "POST"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retry)
+    session = requests.Session()
+    # requests already sends Accept-Encoding: gzip; Google APIs only compress when the UA says "gzip" too
+    session.headers["User-Agent"] = f"{session.headers.get('User-Agent', 'python-requests')} (gzip)"
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+_SESSION = _make_session()
 
 # ---------------- Google Sheets ----------------
-def get_values(spreadsheet_id, sheet_name, creds):
-    service = build("sheets", "v4", credentials=creds, cache_discovery=False)
-    result = service.spreadsheets().values().get(
-        spreadsheetId=spreadsheet_id,
-        range=f"{sheet_name}",
-        valueRenderOption="UNFORMATTED_VALUE"
-    ).execute()
-    return result.get("values", []) or []
+SHEETS_VALUES_URL = "https://sheets.googleapis.com/v4/spreadsheets/{spreadsheet_id}/values/{range}"
+SHEETS_SPREADSHEET_URL = "https://sheets.googleapis.com/v4/spreadsheets/{spreadsheet_id}"
+SHEETS_BATCH_GET_URL = "https://sheets.googleapis.com/v4/spreadsheets/{spreadsheet_id}/values:batchGet"
+
+def _a1_range(sheet_name: str, start_row: int = 1, page_rows: int = 0) -> str:
+    """
+    Whole tab for start_row=1, else the rows from start_row down; page_rows > 0 limits the
+    range to that many rows. The tab name is always quoted so names like "Q1" stay tab names.
+    """
+    quoted = "'" + sheet_name.replace("'", "''") + "'"
+    if start_row <= 1 and page_rows <= 0:
+        return quoted
+    end = f"{start_row + page_rows - 1}" if page_rows > 0 else ""
+    return f"{quoted}!A{start_row}:ZZZ{end}"
+
+@lru_cache(maxsize=8)
+def _load_creds_cached(path: str, mtime_ns: int):
+    with open(path, "rb") as f:
+        info = _loads(f.read())
+    return service_account.Credentials.from_service_account_info(info, scopes=SCOPES)
+
+def load_creds(sa_key_file: str):
+    """Service-account credentials, reused (with their token) until the key file changes."""
+    return _load_creds_cached(sa_key_file, os.stat(sa_key_file).st_mtime_ns)
+
+def _auth_headers(creds) -> Dict[str, str]:
+    if not creds.valid:
+        creds.refresh(GoogleAuthRequest(session=_SESSION))
+    return {"Authorization": f"Bearer {creds.token}"}
+
+def _sheets_get(url: str, creds, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Authorized GET on the shared session; a 401 refreshes the token once and retries."""
+    resp = _SESSION.get(url, headers=_auth_headers(creds), params=params, timeout=60)
+    if resp.status_code == 401:
+        creds.refresh(GoogleAuthRequest(session=_SESSION))
+        resp = _SESSION.get(url, headers=_auth_headers(creds), params=params, timeout=60)
+    resp.raise_for_status()
+    return _loads(resp.content)
+
+def _a1_header(sheet_name: str) -> str:
+    """The tab's first (header) row."""
+    return "'" + sheet_name.replace("'", "''") + "'!1:1"
+
+def _get_ranges(spreadsheet_id, ranges: List[str], creds) -> List[List[List[Any]]]:
+    """Values of A1 ranges in request order: one values GET for a single range, else one batchGet."""
+    sid = quote(spreadsheet_id, safe="")
+    if len(ranges) == 1:
+        url = SHEETS_VALUES_URL.format(spreadsheet_id=sid, range=quote(ranges[0], safe=""))
+        result = _sheets_get(url, creds, {
+            "valueRenderOption": "UNFORMATTED_VALUE",
+            "fields": "values",  # only the cells; drop range/majorDimension from the response
+        })
+        return [result.get("values", []) or []]
+    result = _sheets_get(SHEETS_BATCH_GET_URL.format(spreadsheet_id=sid), creds, {
+        "ranges": ranges,
+        "valueRenderOption": "UNFORMATTED_VALUE",
+        "fields": "valueRanges.values",
+    })
+    # valueRanges come back in request order
+    got = [(vr.get("values", []) or []) for vr in result.get("valueRanges", []) or []]
+    return got + [[]] * (len(ranges) - len(got))
+
+def get_values(spreadsheet_id, sheet_name, creds, start_row: int = 1, page_rows: int = 0):
+    return _get_ranges(spreadsheet_id, [_a1_range(sheet_name, start_row, page_rows)], creds)[0]
+
+def get_row_counts(spreadsheet_id, creds) -> Dict[str, int]:
+    """Grid row count of every tab, by title (one spreadsheets.get, properties only)."""
+    url = SHEETS_SPREADSHEET_URL.format(spreadsheet_id=quote(spreadsheet_id, safe=""))
+    result = _sheets_get(url, creds, {"fields": "sheets.properties(title,gridProperties.rowCount)"})
+    counts = {}
+    for sheet in result.get("sheets", []) or []:
+        props = sheet.get("properties") or {}
+        counts[props.get("title")] = int((props.get("gridProperties") or {}).get("rowCount") or 0)
+    return counts
+
+def get_values_batch(spreadsheet_id, sheet_names: List[str], creds,
+                     start_rows: Optional[Dict[str, int]] = None, page_rows: int = 0) -> Dict[str, List[List[Any]]]:
+    """Values of several tabs (each from its start row, default 1) in one batchGet request."""
+    start_rows = start_rows or {}
+    ranges = [_a1_range(name, start_rows.get(name, 1), page_rows) for name in sheet_names]
+    return dict(zip(sheet_names, _get_ranges(spreadsheet_id, ranges, creds)))
+
+# ---------------- Sync State ----------------
+def _default_state_path(json_out: str) -> str:
+    p = Path(json_out)
+    return str(p.with_name("sheet_state.json"))
+
+def _load_state(path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Sync state per spreadsheet and tab: {spreadsheet_id: {sheet_name: {"last_row": int, "header": [...]}}}.
+    Records in the older tab-only layout are dropped (those tabs get one full fetch).
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return {}
+    try:
+        data = _read_json(path)
+        if isinstance(data, dict):
+            return {
+                sid: tabs for sid, tabs in data.items()
+                if isinstance(tabs, dict) and "last_row" not in tabs
+            }
+    except Exception:
+        pass
+    return {}
+
+def _save_state(path: str, state: Dict[str, Any]) -> None:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(_dumps_pretty(state))
+
+def _tab_path(template: str, sheet_name: str) -> str:
+    """Output path for a tab: '{sheet}' in the template becomes a filesystem-safe tab name."""
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in sheet_name)
+    return template.replace("{sheet}", safe)
+
+def _start_row(prev: Dict[str, Any], outputs: List[str], full_refresh: bool) -> int:
+    """Row to fetch from: after the recorded last row when that record and the outputs are usable, else 1."""
+    incremental = (
+        not full_refresh
+        and isinstance(prev.get("last_row"), int) and prev["last_row"] >= 1
+        and isinstance(prev.get("header"), list) and prev["header"]
+        and all(os.path.exists(p) and os.path.getsize(p) > 0 for p in outputs)
+    )
+    return prev["last_row"] + 1 if incremental else 1
+
+def _fetch_rows(spreadsheet_id, sheet_names: List[str], creds, starts: Dict[str, int],
+                page_rows: int = 0, header_tabs: List[str] = ()):
+    """
+    Rows of each tab from its start row, as (rows, headers). Each round is one values GET for a
+    single range, else one batchGet; the current header row of every tab in header_tabs rides
+    along in the first request. Tabs whose start row is past their grid row count (nothing new)
+    are not requested. With page_rows > 0 the tabs are read in windows of that many rows up to
+    each tab's grid row count (blank stretches are not the end: Sheets drops trailing blank rows
+    of every range).
+    """
+    def fetch(first_rows: Dict[str, int], headers=()):
+        names = list(first_rows)
+        ranges = [_a1_range(name, first_rows[name], page_rows) for name in names]
+        got = _get_ranges(spreadsheet_id, ranges + [_a1_header(name) for name in headers], creds)
+        return dict(zip(names, got)), {name: (hdr[0] if hdr else []) for name, hdr in zip(headers, got[len(names):])}
+
+    rows: Dict[str, List[List[Any]]] = {name: [] for name in sheet_names}
+    if page_rows <= 0 and all(starts[name] <= 1 for name in sheet_names):
+        fetched, headers = fetch({name: starts[name] for name in sheet_names}, header_tabs)
+        rows.update(fetched)
+        return rows, headers
+    # Sheets rejects reads starting past the grid, so incremental and paged reads need the row counts
+    row_counts = get_row_counts(spreadsheet_id, creds)
+    missing = [name for name in sheet_names if name not in row_counts]
+    if missing:
+        raise ValueError(f"Tab(s) not found in spreadsheet {spreadsheet_id}: {', '.join(missing)}")
+    headers: Dict[str, List[Any]] = {}
+    pending_headers = list(header_tabs)
+    offset = 0
+    while True:
+        active = {name: starts[name] + offset for name in sheet_names if starts[name] + offset <= row_counts[name]}
+        if not active and not pending_headers:
+            return rows, headers
+        page, got_headers = fetch(active, pending_headers)
+        headers.update(got_headers)
+        pending_headers = []
+        for name in active:
+            got = page.get(name) or []
+            if got:
+                rows[name].extend([[]] * (offset - len(rows[name])))  # blank rows earlier windows dropped
+                rows[name].extend(got)
+        if page_rows <= 0:
+            return rows, headers
+        offset += page_rows
+
+def fetch_values(spreadsheet_id, sheet_names: List[str], creds, prev_states: Dict[str, Dict[str, Any]],
+                 outputs: Dict[str, List[str]], full_refresh: bool = False, page_rows: int = 0):
+    """
+    Return {sheet_name: (values, sheet_state)}. When a previous run recorded a tab's last row and
+    its outputs are still present, only the rows after it are fetched and the stored header is
+    prepended; the tab's current header row is read in the same request, and a tab whose header
+    changed (e.g. a question added to the form) is fetched whole instead. Several tabs are
+    fetched with a single batchGet request (per page of page_rows).
+    """
+    starts = {
+        name: _start_row(prev_states.get(name) or {}, outputs[name], full_refresh)
+        for name in sheet_names
+    }
+    incremental = [name for name in sheet_names if starts[name] > 1]
+    fetched, headers = _fetch_rows(spreadsheet_id, sheet_names, creds, starts, page_rows, incremental)
+    changed = [name for name in incremental if headers.get(name) != prev_states[name]["header"]]
+    if changed:
+        for name in changed:
+            print(f"ℹ️ Header row of '{name}' changed since the last run; fetching the whole tab")
+            starts[name] = 1
+        refetched, _ = _fetch_rows(spreadsheet_id, changed, creds, {name: 1 for name in changed}, page_rows)
+        fetched.update(refetched)
+
+    out = {}
+    for name in sheet_names:
+        prev = prev_states.get(name) or {}
+        rows = fetched.get(name, [])
+        if starts[name] > 1:
+            out[name] = ([prev["header"]] + rows, {"last_row": prev["last_row"] + len(rows), "header": prev["header"]})
+        elif not rows:
+            out[name] = (rows, prev)
+        else:
+            out[name] = (rows, {"last_row": len(rows), "header": rows[0]})
+    return out
 
 # ---------------- Utils ----------------
-def _norm(s): return ("" if s is None else str(s)).strip()
-def _norm_key(s): return _norm(s).lower()
+def _norm(s):
+    # Sheet cells are mostly str already: skip the str() round-trip for them
+    if s.__class__ is str:
+        return s.strip()
+    return ("" if s is None else str(s)).strip()
+
+@lru_cache(maxsize=1 << 16)
+def _norm_key_cached(s: str) -> str:
+    return s.strip().lower()
+
+def _norm_key(s):
+    # Keys (names, terms, headers) repeat across rows and runs; memoize the str case
+    return _norm_key_cached(s) if isinstance(s, str) else _norm(s).lower()
+
+def _header_index(headers) -> Dict[str, int]:
+    """Case-insensitive header -> column position, built once per header row (last duplicate wins)."""
+    return {_norm_key(h): i for i, h in enumerate(headers)}
+
+def _find_header(index: Dict[str, int], names) -> Optional[int]:
+    """First of the (already normalized) candidate names present in the header index."""
+    for name in names:
+        i = index.get(name)
+        if i is not None:
+            return i
+    return None
+
+def _normalized_rows(rows, width: int) -> List[tuple]:
+    """
+    Normalize sheet rows column by column (padded/trimmed to width) and return them as tuples.
+    Working per column keeps the normalization in tight comprehensions instead of per-row dict builds;
+    str cells (and the "" padding) are stripped inline, only None/numbers go through _norm.
+    """
+    if not rows:
+        return []
+    cols = list(zip_longest(*rows, fillvalue=""))[:width]
+    cols.extend([("",) * len(rows)] * (width - len(cols)))
+    return list(zip(*[[v.strip() if v.__class__ is str else _norm(v) for v in col] for col in cols]))
+
+def _rows_by_name(rows, name_idx: int, skip=(), keep_last: bool = False) -> List[Any]:
+    """
+    Raw sheet rows reduced to one per non-empty Name key (first or last occurrence,
+    at the first occurrence's position), dropping keys found in skip. Only the Name
+    cell is normalized here, so rows filtered out never reach the full-row mapper.
+    """
+    picked: Dict[str, Any] = {}
+    for row in rows:
+        key = _norm_key(row[name_idx]) if name_idx < len(row) else ""
+        if not key or key in skip:
+            continue
+        if keep_last or key not in picked:
+            picked[key] = row
+    return list(picked.values())
 
 def _existing_keys_csv(out_path):
+    """
+    Scan the Name (or Submitted By) column of an existing CSV.
+    Unquoted lines are split on raw bytes; only records containing quotes go through csv.reader.
+    """
     keys = set()
     if not os.path.exists(out_path) or os.path.getsize(out_path) == 0:
         return keys
-    with open(out_path, "r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            keys.add(_norm_key(row.get("Name") or row.get("Submitted By") or ""))
+    with open(out_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        end = mm.find(b"\n")
+        if end == -1:
+            end = size
+        header = next(csv.reader([mm[:end].decode("utf-8").rstrip("\r")]), [])
+        col = _find_header(_header_index(header), _SUBMITTER_KEYS)
+        if col is None:
+            return keys
+
+        pos = end + 1
+        pending: List[bytes] = []  # lines of a quoted record spanning several lines
+        while pos < size:
+            nl = mm.find(b"\n", pos)
+            if nl == -1:
+                nl = size
+            line = mm[pos:nl]
+            pos = nl + 1
+            if pending or b'"' in line:
+                pending.append(line)
+                record = b"\n".join(pending)
+                if record.count(b'"') % 2:
+                    continue  # quoted field still open
+                pending = []
+                if record.endswith(b"\r"):
+                    record = record[:-1]
+                fields = next(csv.reader([record.decode("utf-8")]), [])
+                if len(fields) > col:
+                    keys.add(_norm_key(fields[col]))
+            else:
+                fields = line.split(b",", col + 1)
+                if len(fields) > col:
+                    keys.add(_norm_key(fields[col].decode("utf-8")))
+    return keys
+
+def _keys_sidecar_path(out_path) -> str:
+    return str(out_path) + ".keys"
+
+def _dumps_keys(keys) -> bytes:
+    """Sidecar lines: one JSON string per key, so keys containing newlines stay on one line."""
+    return b"".join(_dumps_line(k) + b"\n" for k in keys)
+
+def _read_keys_sidecar(sidecar) -> Optional[set]:
+    """Keys from a sidecar, or None when any line is not a JSON string (e.g. an older raw-line sidecar)."""
+    keys = set()
+    with open(sidecar, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                key = _loads(line)
+            except ValueError:
+                return None
+            if not isinstance(key, str):
+                return None
+            keys.add(key)
     return keys
 
+def _load_keys_sidecar(out_path):
+    """
+    Load the dedupe keys kept in <out_path>.keys (one JSON-encoded normalized key per line).
+    Rebuilds the sidecar from the data file when it is missing, unreadable or older than the data file.
+    """
+    sidecar = _keys_sidecar_path(out_path)
+    if not os.path.exists(out_path) or os.path.getsize(out_path) == 0:
+        return set()
+    if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(out_path):
+        keys = _read_keys_sidecar(sidecar)
+        if keys is not None:
+            return keys
+    keys = _existing_keys_csv(out_path)
+    keys.discard("")
+    with open(sidecar, "wb") as f:
+        f.write(_dumps_keys(keys))
+    return keys
+
+def _dumps_pretty(obj) -> bytes:
+    """indent=2 UTF-8 JSON, laid out like json.dump(..., ensure_ascii=False, indent=2)."""
+    if orjson:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits; let the stdlib encoder handle them
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+def _dumps_line(obj) -> bytes:
+    """Compact single-line UTF-8 JSON (no trailing newline)."""
+    if orjson:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _dumps_entries(objs: List[Dict[str, Any]], json_format: str = "pretty") -> bytes:
+    """JSON output body: an indent=2 array, or one compact entry per line for "jsonl"."""
+    if json_format == "jsonl":
+        return b"".join(_dumps_line(o) + b"\n" for o in objs)
+    return _dumps_pretty(objs)
+
+def _loads(data):
+    """Parse JSON text/bytes with orjson when available."""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def _read_json(path):
+    with open(path, "rb") as f:
+        return _loads(f.read())
+
+def _write_if_changed(path, data: bytes) -> bool:
+    """Replace the file only when its bytes differ; returns True if it was written."""
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(path, "wb") as f:
+        f.write(data)
+    return True
+
 def _load_existing_json(out_path) -> List[Dict[str, Any]]:
+    """Entries of a previous output, written either as a JSON array or as JSON Lines."""
     if not os.path.exists(out_path) or os.path.getsize(out_path) == 0:
         return []
     try:
-        with open(out_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            if isinstance(data, list):
-                return data
+        data = _read_json(out_path)
+        if isinstance(data, list):
+            return data
     except Exception:
-        pass
-    return []
+        pass  # not a single JSON document: try one entry per line
+    objs = []
+    try:
+        with open(out_path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    obj = _loads(line)
+                except ValueError:
+                    continue
+                if isinstance(obj, dict):
+                    objs.append(obj)
+    except OSError:
+        return []
+    return objs
 
-def _index_by_name(objs: List[Dict[str, Any]]):
-    idx = {}
-    for i, obj in enumerate(objs):
-        name = _norm_key(obj.get("fields", {}).get("Name", ""))
-        if name:
-            idx[name] = i
-    return idx
+def _entry_name(fields: Dict[str, Any]):
+    """The Name field of an entry, matched case-insensitively like the sheet header."""
+    if "Name" in fields:
+        return fields["Name"]
+    for k, v in fields.items():
+        if _norm_key(k) in _NAME_KEYS:
+            return v
+    return ""
+
+def _entries_by_name(objs: List[Dict[str, Any]]) -> Dict[Any, Dict[str, Any]]:
+    """
+    Key existing entries by normalized Name, keeping file order. Entries without a name,
+    and earlier duplicates of a name, are kept under (index,) placeholder keys so they
+    are still written back unchanged.
+    """
+    names = [_norm_key(_entry_name(obj.get("fields") or {})) for obj in objs]
+    last = {name: i for i, name in enumerate(names) if name}
+    return {(name if name and last[name] == i else (i,)): obj for i, (name, obj) in enumerate(zip(names, objs))}
 
 # --------------- Shared Mappings Store (cache) ----------------
 def _default_store_path(json_out: str) -> str:
@@ -123,19 +613,31 @@ def _load_store(path: str) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
     if not os.path.exists(path) or os.path.getsize(path) == 0:
         return {"Role": {}, "Expertise": {}, "Interest": {}}
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            # ensure structure
-            for k in ("Role", "Expertise", "Interest"):
-                data.setdefault(k, {})
-            return data
+        data = _read_json(path)
+        # ensure structure
+        for k in ("Role", "Expertise", "Interest"):
+            data.setdefault(k, {})
+        return data
     except Exception:
         return {"Role": {}, "Expertise": {}, "Interest": {}}
 
 def _save_store(path: str, store: Dict[str, Any]) -> None:
     Path(path).parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(store, f, ensure_ascii=False, indent=2)
+    with open(path, "wb") as f:
+        f.write(_dumps_pretty(store))
+
+def _has_explanation(merged: str, ex: str) -> bool:
+    """
+    True if ex is merged itself or one of the whole "; "-joined pieces an earlier merge produced.
+    Only piece boundaries are checked; the free text is never re-split or re-sorted.
+    """
+    merged, ex = merged.strip(), ex.strip()
+    return (
+        merged == ex
+        or merged.startswith(ex + "; ")
+        or merged.endswith("; " + ex)
+        or ("; " + ex + "; ") in merged
+    )
 
 def _merge_mapping_list(existing_list: List[Dict[str, Any]], new_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
@@ -144,42 +646,90 @@ def _merge_mapping_list(existing_list: List[Dict[str, Any]], new_list: List[Dict
     """
     by_id = { (m.get("ontology_id") or "", m.get("ontology") or ""): m for m in existing_list or [] }
     for m in new_list or []:
-        key = (m.get("ontology_id") or "", m.get("ontology") or "")
-        if key in by_id:
-            cur = by_id[key]
-            # Keep the higher confidence
-            try:
-                if (m.get("confidence") or 0) > (cur.get("confidence") or 0):
-                    cur["confidence"] = m.get("confidence")
-            except Exception:
-                pass
-            # Prefer non-null concept_label
-            if not cur.get("concept_label") and m.get("concept_label"):
-                cur["concept_label"] = m.get("concept_label")
-            # Merge/shorten explanations
-            ex_set = {e.strip() for e in [cur.get("explanation", ""), m.get("explanation", "")] if e}
-            cur["explanation"] = "; ".join(sorted(ex_set)) if ex_set else None
-        else:
+        oid, onto = m.get("ontology_id"), m.get("ontology")
+        key = (oid or "", onto or "")
+        cur = by_id.get(key)
+        if cur is None:
             by_id[key] = {
                 "concept_label": m.get("concept_label"),
-                "ontology_id": m.get("ontology_id"),
-                "ontology": m.get("ontology"),
+                "ontology_id": oid,
+                "ontology": onto,
                 "confidence": m.get("confidence"),
                 "explanation": m.get("explanation"),
             }
+            continue
+        # Keep the higher confidence
+        conf = m.get("confidence")
+        try:
+            if (conf or 0) > (cur.get("confidence") or 0):
+                cur["confidence"] = conf
+        except Exception:
+            pass
+        # Prefer non-null concept_label
+        if not cur.get("concept_label") and m.get("concept_label"):
+            cur["concept_label"] = m.get("concept_label")
+        # Merge/shorten explanations; an identical or empty new one changes nothing
+        old_ex, new_ex = cur.get("explanation") or "", m.get("explanation") or ""
+        if new_ex and not _has_explanation(old_ex, new_ex):
+            ex_set = {e.strip() for e in (old_ex, new_ex) if e}
+            cur["explanation"] = "; ".join(sorted(ex_set))
+        else:
+            cur["explanation"] = old_ex.strip() if old_ex else None
     return list(by_id.values())
 
+# ---------------- LLM Response Cache ----------------
+def _default_llm_cache_path(json_out: str) -> str:
+    p = Path(json_out)
+    return str(p.with_name("llm_cache.jsonl"))
+
+def _llm_cache_key(record: Dict[str, Any], model: str) -> str:
+    # Model and prompt version are part of the key so switching either re-maps instead of reusing stale answers
+    parts = [model or "", _PROMPT_VERSION] + [_norm(record.get(cat)) for cat in ("Role", "Expertise", "Interest")]
+    raw = "\x00".join(parts)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+def _load_llm_cache(path: Optional[str]) -> Dict[str, Any]:
+    """Read the append-only cache: one {key: llm_output} object per line."""
+    cache: Dict[str, Any] = {}
+    if not path or not os.path.exists(path):
+        return cache
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                entry = _loads(line)
+            except ValueError:
+                continue  # torn line from an interrupted run
+            if isinstance(entry, dict):
+                cache.update(entry)
+    return cache
+
+def _append_llm_cache(path: Optional[str], entries: Dict[str, Any]) -> None:
+    if not path or not entries:
+        return
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as f:
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")  # terminate a torn line left by an interrupted run
+        f.write(b"".join(_dumps_line({k: v}) + b"\n" for k, v in entries.items()))
+
 # ---------------- OpenRouter LLM Mapping ----------------
+# Bump whenever _llm_system_prompt/_llm_user_prompt change meaningfully; invalidates the response cache
+_PROMPT_VERSION = "batch-v1"
+
 def _llm_system_prompt():
     # NOTE: include source_term to key the shared cache
     prompt = """
 You are an Ontology Mapping Assistant.
 
 TASK:
-1) Read Role, Expertise, and Interest (free-text).
-2) Identify and map each relevant word/phrase to a public-ontology concept.
-3) Return STRICT JSON with exactly keys: Role, Expertise, Interest.
-   Each is a list of objects with the schema:
+1) Read a batch of users, each with an id and Role, Expertise, and Interest (free-text).
+2) For every user, identify and map each relevant word/phrase to a public-ontology concept.
+3) Return STRICT JSON with exactly one key: results.
+   results is a list with one object per input item, in input order:
+   {"id": <same id as the input item>, "Role": [...], "Expertise": [...], "Interest": [...]}
+   Role, Expertise and Interest are lists of objects with the schema:
    {
      "source_term": str,                     // the exact word/phrase you mapped
      "concept_label": str|null,
@@ -196,23 +746,29 @@ RULES:
 - Keep outputs compact and valid JSON.
 
 EXAMPLE (Interest only shown for brevity):
-Input: {"Role":"","Expertise":"","Interest":"how the human social brain develops"}
+Input: {"items":[{"id":0,"Role":"","Expertise":"","Interest":"how the human social brain develops"}]}
 Output: {
-  "Role": [],
-  "Expertise": [],
-  "Interest": [
-    {"source_term":"human","concept_label":"Human","ontology_id":"Wikidata:Q5","ontology":"Wikidata","confidence":0.9,"explanation":"Human species"},
-    {"source_term":"brain","concept_label":"Brain","ontology_id":"Wikidata:Q1073","ontology":"Wikidata","confidence":0.9,"explanation":"Organ"}
+  "results": [
+    {
+      "id": 0,
+      "Role": [],
+      "Expertise": [],
+      "Interest": [
+        {"source_term":"human","concept_label":"Human","ontology_id":"Wikidata:Q5","ontology":"Wikidata","confidence":0.9,"explanation":"Human species"},
+        {"source_term":"brain","concept_label":"Brain","ontology_id":"Wikidata:Q1073","ontology":"Wikidata","confidence":0.9,"explanation":"Organ"}
+      ]
+    }
   ]
 }
 """
     return prompt
 
-def _llm_user_prompt(role, expertise, interest):
-    return json.dumps(
-        {"Role": role or "", "Expertise": expertise or "", "Interest": interest or ""},
-        ensure_ascii=False
-    )
+def _llm_user_prompt(records: List[Dict[str, Any]]):
+    items = [
+        {"id": i, "Role": r.get("Role") or "", "Expertise": r.get("Expertise") or "", "Interest": r.get("Interest") or ""}
+        for i, r in enumerate(records)
+    ]
+    return json.dumps({"items": items}, ensure_ascii=False)
 
 def _call_openrouter(base_url, api_key, model, system_prompt, user_prompt, timeout):
     headers = {
@@ -228,58 +784,215 @@ def _call_openrouter(base_url, api_key, model, system_prompt, user_prompt, timeo
         ],
     }
     try:
-        resp = requests.post(base_url, headers=headers, json=payload, timeout=timeout)
+        resp = _SESSION.post(base_url, headers=headers, json=payload, timeout=timeout)
         resp.raise_for_status()
-        return json.loads(resp.json()["choices"][0]["message"]["content"])
-    except Exception as e:
-        print(f"OpenRouter call failed: {e}")
+        return _loads(_loads(resp.content)["choices"][0]["message"]["content"])
+    except requests.HTTPError as e:
+        status = e.response.status_code if e.response is not None else None
+        if status in _RETRY_STATUSES:
+            print(f"OpenRouter call failed after retries (HTTP {status}); these users stay unmapped until the next run")
+        else:
+            body = e.response.text[:200] if e.response is not None else ""
+            print(f"OpenRouter rejected the request (HTTP {status}), not retrying: {body}")
         return None
-
-def get_mappings(role, expertise, interest, cfg):
-    api_key = os.getenv("OPENROUTER_API_KEY")  # GitHub secret
-    if not api_key:
-        print("ℹ️ OPENROUTER_API_KEY not set; skipping ontology mapping.")
+    except requests.RequestException as e:
+        print(f"OpenRouter call failed after retries: {e}")
+        return None
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        print(f"OpenRouter returned an unusable response: {e!r}")
         return None
-    res = _call_openrouter(
+
+def _split_batch_results(res: Optional[Dict[str, Any]], n: int) -> List[Optional[Dict[str, Any]]]:
+    """Align a batch response with its n input items (by id, falling back to position)."""
+    out: List[Optional[Dict[str, Any]]] = [None] * n
+    results = res.get("results") if isinstance(res, dict) else None
+    if not isinstance(results, list):
+        return out
+    for pos, item in enumerate(results):
+        if not isinstance(item, dict):
+            continue
+        i = item.get("id", pos)
+        if isinstance(i, int) and 0 <= i < n and out[i] is None:
+            out[i] = item
+    return out
+
+_THROTTLE_LOCK = threading.Lock()
+_next_call_at = 0.0
+
+def _throttle(min_interval: float) -> None:
+    """Space request starts at least min_interval seconds apart across all worker threads."""
+    global _next_call_at
+    if min_interval <= 0:
+        return
+    with _THROTTLE_LOCK:
+        now = time.monotonic()
+        wait = _next_call_at - now
+        _next_call_at = max(now, _next_call_at) + min_interval
+    if wait > 0:
+        time.sleep(wait)
+
+_COMPLETION_TOKENS_PER_ITEM = 150  # rough allowance for one item's results in the reply
+
+class _TokenBudget:
+    """
+    Sliding one-minute window of requests and estimated tokens shared by all worker threads.
+    acquire() blocks until the call fits under both limits (0 disables a limit); a single call
+    larger than the whole token budget is let through once the window is empty.
+    """
+
+    WINDOW = 60.0
+
+    def __init__(self, tpm: int = 0, rpm: int = 0):
+        self.tpm = max(0, tpm or 0)
+        self.rpm = max(0, rpm or 0)
+        self._calls: deque = deque()  # (start time, estimated tokens), oldest first
+        self._tokens = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, est_tokens: int) -> None:
+        if not self.tpm and not self.rpm:
+            return
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0][0] >= self.WINDOW:
+                    self._tokens -= self._calls.popleft()[1]
+                fits_rpm = not self.rpm or len(self._calls) < self.rpm
+                fits_tpm = not self.tpm or not self._calls or self._tokens + est_tokens <= self.tpm
+                if fits_rpm and fits_tpm:
+                    self._calls.append((now, est_tokens))
+                    self._tokens += est_tokens
+                    return
+                # Sleep until the oldest call leaves the window
+                self._cond.wait(self._calls[0][0] + self.WINDOW - now)
+
+def _request_mappings(records: List[Dict[str, Any]], api_key: str, cfg,
+                      budget: Optional[_TokenBudget] = None) -> Optional[Dict[str, Any]]:
+    system_prompt, user_prompt = _llm_system_prompt(), _llm_user_prompt(records)
+    if budget is not None:
+        budget.acquire((len(system_prompt) + len(user_prompt)) // 4 + _COMPLETION_TOKENS_PER_ITEM * len(records))
+    _throttle(cfg.get("sleep_s", 0))
+    return _call_openrouter(
         cfg["base_url"], api_key, cfg["model"],
-        _llm_system_prompt(),
-        _llm_user_prompt(role, expertise, interest),
+        system_prompt,
+        user_prompt,
         cfg["timeout"]
     )
-    if cfg.get("sleep_s", 0):
-        time.sleep(cfg["sleep_s"])
-    return res
+
+def _map_chunk(chunk: List[Dict[str, Any]], api_key: str, cfg,
+               budget: Optional[_TokenBudget] = None) -> List[Optional[Dict[str, Any]]]:
+    res = _request_mappings(chunk, api_key, cfg, budget)
+    out = _split_batch_results(res, len(chunk))
+    if res is not None and len(chunk) > 1:
+        # The model answered but dropped or garbled items: map those one at a time
+        for i, item in enumerate(out):
+            if item is None:
+                out[i] = _split_batch_results(_request_mappings([chunk[i]], api_key, cfg, budget), 1)[0]
+    return out
+
+def get_mappings_batch(records: List[Dict[str, Any]], cfg, batch_size: int = 20) -> List[Optional[Dict[str, Any]]]:
+    """
+    Map Role/Expertise/Interest for many records with one OpenRouter request per batch.
+    Records already in the response cache (cfg["cache_path"]) are answered without a request;
+    the remaining batches run concurrently on up to cfg["concurrency"] threads, paced by the
+    cfg["tpm"] / cfg["rpm"] per-minute budget. Records with identical Role/Expertise/Interest
+    are sent once and share the answer.
+    Returns one LLM output (or None) per record, in input order.
+    """
+    cache = _load_llm_cache(cfg.get("cache_path"))
+    keys = [_llm_cache_key(r, cfg["model"]) for r in records]
+    out: List[Optional[Dict[str, Any]]] = [cache.get(k) for k in keys]
+    same: Dict[str, List[int]] = {}  # cache key -> positions of the uncached records sharing it
+    for i, res in enumerate(out):
+        if res is None:
+            same.setdefault(keys[i], []).append(i)
+    todo = [pos[0] for pos in same.values()]
+    if not todo:
+        return out
+
+    api_key = os.getenv("OPENROUTER_API_KEY")  # GitHub secret
+    if not api_key:
+        print("ℹ️ OPENROUTER_API_KEY not set; skipping ontology mapping.")
+        return out
+    batch_size = batch_size if batch_size > 0 else len(todo)  # 0: everything in one request
+    budget = _TokenBudget(cfg.get("tpm", 0), cfg.get("rpm", 0))
+    with ThreadPoolExecutor(max_workers=max(1, cfg.get("concurrency", 1))) as ex:
+        futures = {
+            ex.submit(_map_chunk, [records[i] for i in todo[start:start + batch_size]], api_key, cfg, budget): start
+            for start in range(0, len(todo), batch_size)
+        }
+        for fut in as_completed(futures):
+            start = futures[fut]
+            fresh = {}
+            for i, res in zip(todo[start:start + batch_size], fut.result()):
+                for j in same[keys[i]]:
+                    out[j] = res
+                if res:
+                    fresh[keys[i]] = {cat: res.get(cat) or [] for cat in ("Role", "Expertise", "Interest")}
+            # Persist each batch as it lands so an interrupted run keeps what it paid for
+            _append_llm_cache(cfg.get("cache_path"), fresh)
+    return out
 
 # ---------------- Writers ----------------
-def append_csv(values, out_path):
-    Path(out_path).parent.mkdir(parents=True, exist_ok=True)
-    if not values:
-        return
+class DedupWriter:
+    """
+    Append-only CSV writer that drops rows whose key was already written.
+    Keys are loaded once from the .keys sidecar; accepted rows are buffered and
+    written (with their keys) in one go on close().
+    """
+
+    def __init__(self, out_path, fieldnames: List[str]):
+        self.out_path = out_path
+        self.fieldnames = fieldnames
+        self._keys = _load_keys_sidecar(out_path)
+        self._rows: List[tuple] = []
+        self._new_keys: List[str] = []
 
-    headers_raw = [_norm(h) for h in values[0]]
-    headers_mapped = map_columns_to_labels(headers_raw)
-    rows = values[1:]
+    def add(self, row, key: str) -> bool:
+        """Queue a row (values in fieldnames order) unless its key was already written."""
+        if not key or key in self._keys:
+            return False
+        self._keys.add(key)
+        self._rows.append(row)
+        self._new_keys.append(key)
+        return True
 
-    existing_keys = _existing_keys_csv(out_path)
-    write_header = not os.path.exists(out_path) or os.path.getsize(out_path) == 0
+    def __contains__(self, key: str) -> bool:
+        return key in self._keys
 
-    with open(out_path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=headers_mapped)
+    def close(self) -> None:
+        write_header = not os.path.exists(self.out_path) or os.path.getsize(self.out_path) == 0
+        if not self._rows and not write_header:
+            return
+        # Sidecar is opened first so it is closed last and stays at least as new as the CSV;
+        # a fresh CSV also starts a fresh sidecar.
+        # Format everything in memory and hand each file a single write.
+        buf = io.StringIO(newline="")
+        writer = csv.writer(buf)
         if write_header:
-            writer.writeheader()
-        for row in rows:
-            row_dict = {headers_mapped[i]: _norm(row[i]) if i < len(row) else "" for i in range(len(headers_mapped))}
-            key = _norm_key(row_dict.get("Name", ""))
-            if key and key not in existing_keys:
-                writer.writerow(row_dict)
-                existing_keys.add(key)
+            writer.writerow(self.fieldnames)
+        writer.writerows(self._rows)
+        with open(_keys_sidecar_path(self.out_path), "wb" if write_header else "ab") as kf, \
+                open(self.out_path, "a", newline="", encoding="utf-8") as f:
+            f.write(buf.getvalue())
+            kf.write(_dumps_keys(self._new_keys))
+        self._rows, self._new_keys = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
 
 def _ensure_store_keys(store: Dict[str, Any]):
     for k in ("Role", "Expertise", "Interest"):
         store.setdefault(k, {})
 
-def _update_store_with_llm(store: Dict[str, Any], llm_out: Dict[str, Any]):
+def _update_store_with_llm(store: Dict[str, Any], llm_out: Dict[str, Any]) -> bool:
+    """Merge one LLM output into the store; returns True if any term was added or updated."""
     _ensure_store_keys(store)
+    changed = False
     for cat in ("Role", "Expertise", "Interest"):
         items = llm_out.get(cat) or []
         # Group by source_term
@@ -298,26 +1011,44 @@ def _update_store_with_llm(store: Dict[str, Any], llm_out: Dict[str, Any]):
         # Merge into store
         for term, new_list in by_term.items():
             existing_list = store[cat].get(term, [])
-            store[cat][term] = _merge_mapping_list(existing_list, new_list)
+            # _merge_mapping_list updates existing mappings in place: compare against a copy
+            before = [dict(m) for m in existing_list]
+            merged = _merge_mapping_list(existing_list, new_list)
+            if merged != before:
+                store[cat][term] = merged
+                changed = True
+    return changed
+
+@lru_cache(maxsize=4096)
+def _split_term(term: str) -> tuple:
+    """Fallback lookup chunks of a normalized term: split on commas and " and "."""
+    return tuple(c.strip() for c in term.replace(" and ", ",").split(",") if c.strip())
 
-def _snapshot_user_mappings_from_store(store: Dict[str, Any], fields: Dict[str, str]) -> Dict[str, Any]:
+def _field_terms(fields: Dict[str, str]) -> Dict[str, str]:
+    """Normalized Role/Expertise/Interest terms of an entry, computed once per entry."""
+    return {cat: _norm_key(fields.get(cat, "")) for cat in ("Role", "Expertise", "Interest")}
+
+def _snapshot_user_mappings_from_store(store: Dict[str, Any], fields: Dict[str, str],
+                                       terms: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
     """Lookup Role/Expertise/Interest strings as whole terms in the store and return snapshot mapping lists."""
+    if terms is None:
+        terms = _field_terms(fields)
     out = {"Role": [], "Expertise": [], "Interest": []}
     for cat in ("Role", "Expertise", "Interest"):
-        term = _norm_key(fields.get(cat, ""))
+        term = terms[cat]
         if not term:
             out[cat] = []
             continue
+        cat_store = store.get(cat, {})
         # If the whole field isn't a key, try simple splits (fallback)
-        if term in store.get(cat, {}):
-            out[cat] = store[cat][term]
+        if term in cat_store:
+            out[cat] = cat_store[term]
         else:
             # fallback heuristic: split on commas and "and"; then look up each chunk
             aggregates: List[Dict[str, Any]] = []
-            chunks = [c.strip() for c in term.replace(" and ", ",").split(",") if c.strip()]
             seen = set()
-            for ch in chunks:
-                lst = store.get(cat, {}).get(ch, [])
+            for ch in _split_term(term):
+                lst = cat_store.get(ch, [])
                 for m in lst:
                     key = (m.get("ontology_id") or "", m.get("ontology") or "")
                     if key not in seen:
@@ -326,95 +1057,161 @@ def _snapshot_user_mappings_from_store(store: Dict[str, Any], fields: Dict[str,
             out[cat] = aggregates
     return out
 
-def write_json_pretty(values, out_path, store_path, llm_cfg, enable_mapping):
-    """
-    Writes a pretty-printed JSON array of user entries.
-    Each entry:
-      {
-        "fields": { ...mapped headers... },
-        "mappings": { "Role": [...], "Expertise": [...], "Interest": [...] }  # pulled from cache; LLM only for misses
-      }
-    De-duplicates by fields.Name (case-insensitive).
-    """
-    Path(out_path).parent.mkdir(parents=True, exist_ok=True)
-    if not values:
-        with open(out_path, "w", encoding="utf-8") as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
-        return
-
-    headers_raw = [_norm(h) for h in values[0]]
-    headers_mapped = map_columns_to_labels(headers_raw)
-    rows = values[1:]
-
+def _write_json_entries(headers_mapped: List[str], rows: List[tuple], name_idx: int,
+                        out_path, store_path, llm_cfg, enable_mapping, json_format: str = "pretty") -> None:
+    """Upsert normalized rows (one per Name) into the JSON output and map what is missing."""
     # Load existing output and index
-    existing_objs = _load_existing_json(out_path)
-    name_index = _index_by_name(existing_objs)
+    entries = _entries_by_name(_load_existing_json(out_path))
 
     # Load mapping store (shared cache)
     if not store_path:
         store_path = _default_store_path(out_path)
     store = _load_store(store_path)
 
-    for row in rows:
-        row_dict = {headers_mapped[i]: _norm(row[i]) if i < len(row) else "" for i in range(len(headers_mapped))}
-        key = _norm_key(row_dict.get("Name", ""))
-        if not key:
-            continue
+    touched: Dict[str, Dict[str, Any]] = {}  # name key -> entry updated by this pull, in sheet order
+    fields_before: Dict[str, Any] = {}  # name key -> fields the entry had before this pull
+    for vals in rows:
+        row_dict = dict(zip(headers_mapped, vals))
+        key = _norm_key(vals[name_idx])
 
         # Ensure an entry exists (insert or update fields)
-        if key in name_index:
-            obj = existing_objs[name_index[key]]
+        obj = entries.get(key)
+        if obj is not None:
+            fields_before[key] = obj.get("fields")
             obj["fields"] = row_dict
         else:
             obj = {"fields": row_dict}
-            existing_objs.append(obj)
-            name_index[key] = len(existing_objs) - 1
+            entries[key] = obj
+        touched[key] = obj
 
+    # Every entry is checked, not only this pull's rows: users left unmapped by an earlier
+    # failed or key-less run are picked up again (a store lookup, or a cached LLM answer)
+    pending: List[Dict[str, Any]] = []
+    for key, obj in entries.items():
+        fields = obj.get("fields")
+        if not isinstance(fields, dict):
+            continue
+        terms = _field_terms(fields)
+        # Unchanged entry whose mappings already cover every filled-in category: nothing to do
+        mappings = obj.get("mappings") or {}
+        unchanged = key not in touched or fields_before.get(key) == fields
+        if unchanged and all(mappings.get(cat) for cat, term in terms.items() if term):
+            continue
         # Build mappings snapshot from store first
-        obj["mappings"] = _snapshot_user_mappings_from_store(store, row_dict)
+        obj["mappings"] = _snapshot_user_mappings_from_store(store, fields, terms)
 
-        # If mapping enabled, detect missing categories (no mappings found) and call LLM once to enrich store
+        # If mapping enabled, queue users with missing categories (no mappings found) for the LLM
         if enable_mapping:
-            missing = any(len(obj["mappings"].get(cat, [])) == 0 and _norm_key(row_dict.get(cat, "")) for cat in ("Role","Expertise","Interest"))
+            missing = any(term and not obj["mappings"][cat] for cat, term in terms.items())
             if missing:
-                llm_out = get_mappings(row_dict.get("Role"), row_dict.get("Expertise"), row_dict.get("Interest"), llm_cfg)
-                if llm_out:
-                    # Update the shared store (merge; never overwrite)
-                    _update_store_with_llm(store, llm_out)
-                    # Refresh the snapshot for this user from the (now enriched) store
-                    obj["mappings"] = _snapshot_user_mappings_from_store(store, row_dict)
+                pending.append(obj)
 
-    # Write pretty JSON for users
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(existing_objs, f, ensure_ascii=False, indent=2)
+    # Enrich the store for all queued users with batched LLM calls
+    store_dirty = not os.path.exists(store_path)
+    if pending:
+        llm_outs = get_mappings_batch([obj["fields"] for obj in pending], llm_cfg, llm_cfg.get("batch_size", 20))
+        for llm_out in llm_outs:
+            if llm_out:
+                # Update the shared store (merge; never overwrite)
+                store_dirty |= _update_store_with_llm(store, llm_out)
+        # Refresh the snapshots from the (now enriched) store
+        for obj in pending:
+            obj["mappings"] = _snapshot_user_mappings_from_store(store, obj["fields"])
 
-    # Persist the shared mappings store
-    _save_store(store_path, store)
+    # Write the JSON for users (left untouched when nothing changed)
+    _write_if_changed(out_path, _dumps_entries(list(entries.values()), json_format))
+
+    # Persist the shared mappings store (only when it changed)
+    if store_dirty:
+        _save_store(store_path, store)
+
+def process_and_write(values, csv_out, json_out, store_path, llm_cfg, enable_mapping, json_format="pretty"):
+    """
+    One pass over the pulled sheet values feeding both outputs:
+      - csv_out: appends rows whose Name (case-insensitive) was never written.
+      - json_out: user entries, de-duplicated by fields.Name (case-insensitive; the latest row wins),
+        as a pretty-printed JSON array or, with json_format="jsonl", one entry per line. Each entry:
+          {
+            "fields": { ...mapped headers... },
+            "mappings": { "Role": [...], "Expertise": [...], "Interest": [...] }  # pulled from cache; LLM only for misses
+          }
+    The header row is resolved once and each row either output needs is normalized once.
+    """
+    Path(csv_out).parent.mkdir(parents=True, exist_ok=True)
+    Path(json_out).parent.mkdir(parents=True, exist_ok=True)
+    if not values:
+        with open(json_out, "wb") as f:
+            f.write(_dumps_entries([], json_format))
+        return
+
+    headers_mapped = resolve_headers(values[0])
+    name_idx = _find_header(_header_index(headers_mapped), _NAME_KEYS)
+    with DedupWriter(csv_out, headers_mapped) as writer:
+        # CSV keeps the first row of a Name never written; JSON keeps the latest row of every Name
+        csv_rows = _rows_by_name(values[1:], name_idx, skip=writer) if name_idx is not None else []
+        json_rows = _rows_by_name(values[1:], name_idx, keep_last=True) if name_idx is not None else []
+        needed = list({id(r): r for r in csv_rows + json_rows}.values())
+        norm = dict(zip(map(id, needed), _normalized_rows(needed, len(headers_mapped))))
+        for row in csv_rows:
+            vals = norm[id(row)]
+            writer.add(vals, vals[name_idx].lower())
+
+    _write_json_entries(
+        headers_mapped, [norm[id(r)] for r in json_rows], name_idx,
+        json_out, store_path, llm_cfg, enable_mapping, json_format
+    )
 
 def main():
     args = parse_args()
-    with open(args.sa_key_file, "r", encoding="utf-8") as f:
-        info = json.load(f)
-    creds = service_account.Credentials.from_service_account_info(info, scopes=SCOPES)
+    creds = load_creds(args.sa_key_file)
 
-    values = get_values(args.spreadsheet_id, args.sheet_name, creds)
-
-    llm_cfg = {
-        "model": args.openrouter_model,
-        "base_url": args.openrouter_base_url,
-        "timeout": args.openrouter_timeout,
-        "sleep_s": args.openrouter_sleep
+    tabs = {
+        name: (_tab_path(args.csv_out, name), _tab_path(args.json_out, name))
+        for name in args.sheet_name
     }
 
-    # Outputs
-    append_csv(values, args.csv_out)
-    write_json_pretty(
-        values,
-        args.json_out,
-        args.mappings_store,
-        llm_cfg,
-        args.enable_llm_mapping
+    # Only rows added since the last run are fetched, unless --full-refresh
+    state_paths = {
+        name: _tab_path(args.state_file, name) if args.state_file else _default_state_path(json_out)
+        for name, (_, json_out) in tabs.items()
+    }
+    states = {p: _load_state(p) for p in set(state_paths.values())}
+    fetched = fetch_values(
+        args.spreadsheet_id, args.sheet_name, creds,
+        {name: states[state_paths[name]].get(args.spreadsheet_id, {}).get(name) for name in args.sheet_name},
+        {name: list(paths) for name, paths in tabs.items()}, args.full_refresh, args.page_rows
     )
 
+    for name, (csv_out, json_out) in tabs.items():
+        values, sheet_state = fetched[name]
+        llm_cfg = {
+            "model": args.openrouter_model,
+            "base_url": args.openrouter_base_url,
+            "timeout": args.openrouter_timeout,
+            "sleep_s": args.openrouter_sleep,
+            "batch_size": args.openrouter_batch_size,
+            "concurrency": args.openrouter_concurrency,
+            "tpm": args.openrouter_tpm,
+            "rpm": args.openrouter_rpm,
+            "cache_path": _tab_path(args.llm_cache, name) if args.llm_cache else _default_llm_cache_path(json_out)
+        }
+
+        # Outputs
+        process_and_write(
+            values,
+            csv_out,
+            json_out,
+            _tab_path(args.mappings_store, name) if args.mappings_store else None,
+            llm_cfg,
+            args.enable_llm_mapping,
+            args.json_format
+        )
+
+        # Record progress only after both outputs are written
+        if sheet_state:
+            state = states[state_paths[name]]
+            state.setdefault(args.spreadsheet_id, {})[name] = sheet_state
+            _save_state(state_paths[name], state)
+
 if __name__ == "__main__":
     main()